@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-15 07:00
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['session', 'status', '-timestamp'], name='chat_chatme_session_06ac0a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['session', 'role', '-timestamp'], name='chat_chatme_session_035492_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(fields=['user', 'is_active', '-updated_at'], name='chat_chatse_user_id_ce16fe_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mcpoperation',
+            index=models.Index(fields=['message', '-timestamp'], name='chat_mcpope_message_03080c_idx'),
+        ),
+    ]
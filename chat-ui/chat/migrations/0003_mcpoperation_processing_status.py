@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-15 07:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0002_add_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mcpoperation',
+            name='status',
+            field=models.CharField(choices=[('processing', 'Processing'), ('success', 'Success'), ('error', 'Error'), ('timeout', 'Timeout')], max_length=20),
+        ),
+    ]
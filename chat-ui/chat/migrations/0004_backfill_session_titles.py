@@ -0,0 +1,25 @@
+from django.db import migrations
+
+
+def backfill_titles(apps, schema_editor):
+    """Title untitled sessions from their first user message"""
+    ChatSession = apps.get_model('chat', 'ChatSession')
+    ChatMessage = apps.get_model('chat', 'ChatMessage')
+
+    for session in ChatSession.objects.filter(title='').only('id').iterator():
+        first_message = ChatMessage.objects.filter(
+            session_id=session.id, role='user'
+        ).order_by('timestamp').values_list('content', flat=True).first()
+        if first_message:
+            ChatSession.objects.filter(pk=session.id).update(title=first_message[:50])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0003_mcpoperation_processing_status'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_titles, migrations.RunPython.noop),
+    ]
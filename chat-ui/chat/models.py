@@ -20,18 +20,16 @@ class ChatSession(models.Model):
     
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            models.Index(fields=['user', 'is_active', '-updated_at']),
+        ]
         
     def __str__(self):
         return f"Chat Session {self.id} - {self.user.username}"
     
     def get_title(self):
-        """Generate title from first message if not set"""
-        if self.title:
-            return self.title
-        first_message = self.messages.filter(role='user').first()
-        if first_message:
-            return first_message.content[:50] + "..." if len(first_message.content) > 50 else first_message.content
-        return f"Chat {self.created_at.strftime('%Y-%m-%d %H:%M')}"
+        """Return the title (set from the first message), or a dated placeholder"""
+        return self.title or f"Chat {self.created_at:%Y-%m-%d %H:%M}"
 
 class ChatMessage(models.Model):
     """Individual chat message model"""
@@ -71,6 +69,10 @@ class ChatMessage(models.Model):
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['session', 'status', '-timestamp']),
+            models.Index(fields=['session', 'role', '-timestamp']),
+        ]
         
     def __str__(self):
         return f"{self.role}: {self.content[:50]}..."
@@ -91,6 +93,7 @@ class MCPOperation(models.Model):
     ]
     
     STATUS_CHOICES = [
+        ('processing', 'Processing'),
         ('success', 'Success'),
         ('error', 'Error'),
         ('timeout', 'Timeout'),
@@ -108,6 +111,9 @@ class MCPOperation(models.Model):
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            models.Index(fields=['message', '-timestamp']),
+        ]
         
     def __str__(self):
         return f"{self.operation_type} - {self.status}"
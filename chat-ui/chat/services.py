@@ -1,23 +1,150 @@
-import requests
+import hashlib
 import json
 import logging
 import time
-from typing import Dict, Any, Optional, List
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import timedelta
+from functools import lru_cache
+from typing import Dict, Any, Iterator, Optional, List, Tuple
 from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections, transaction
+from django.db.models import Subquery
+from django.utils import timezone
+import httpx
+import orjson
 from openai import OpenAI
 from .models import ChatSession, ChatMessage, MCPOperation
 
 logger = logging.getLogger('chat')
 
+# System prompt shared by every conversation; treat as read-only
+_SYSTEM_MESSAGE = {
+    "role": "system",
+    "content": "You are a helpful AI assistant with access to a chat datastore via MCP tools. You can store and retrieve information using KV operations and query document collections."
+}
+
+# Seconds an MCP capabilities response is served from cache
+CAPABILITIES_CACHE_TTL = 60
+
+# MCP tools without side effects; their successful results are cached for
+# TOOL_CACHE_TTL seconds, and any other successful tool call invalidates them.
+# Invalidation only reaches other workers when CACHES is a shared backend.
+READ_ONLY_TOOLS = frozenset({
+    'kv_get', 'kv_mget', 'kv_scan', 'store_find', 'store_aggregate', 'capabilities_list',
+})
+TOOL_CACHE_TTL = 30
+_TOOL_CACHE_GENERATION_KEY = 'mcp:tools:generation'
+
+# Loop detection: how many recent turn fingerprints are kept on the session
+# and how often one may recur before the LLM call is short-circuited
+LOOP_HASH_HISTORY = 10
+LOOP_REPEAT_LIMIT = 3
+_LOOP_DETECTED_ERROR = "The same request keeps failing; stopped to avoid a retry loop"
+
+# Shared pool for fanning out independent MCP tool calls
+_mcp_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix='mcp-tool')
+
+# Pool generating AI replies off the request thread
+_chat_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='chat-reply')
+
+
+# Process-wide HTTP client shared by the MCP and Ollama clients. HTTP/2 lets
+# concurrent calls to the same server share one connection (negotiated via
+# TLS ALPN; plain http:// URLs fall back to pooled HTTP/1.1).
+# Connection failures are retried by the transport. Per-call timeouts must
+# keep the short connect timeout, since a bare number replaces all of them.
+HTTP_CONNECT_TIMEOUT = 2
+
+# Read timeouts for MCP tool calls and AI replies. Background work still
+# 'processing' after this long has been lost and is reported as timed out.
+MCP_CALL_TIMEOUT = 30
+AI_REPLY_TIMEOUT = 60
+_http_client = httpx.Client(
+    timeout=httpx.Timeout(30, connect=HTTP_CONNECT_TIMEOUT),
+    transport=httpx.HTTPTransport(
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        retries=3
+    )
+)
+
+
+def _update_instance(instance, **fields) -> None:
+    """Write only the given columns with a single UPDATE and mirror them on the instance"""
+    type(instance).objects.filter(pk=instance.pk).update(**fields)
+    for name, value in fields.items():
+        setattr(instance, name, value)
+
+def _update_if_processing(instance, **fields) -> bool:
+    """Like _update_instance, but only while the row is still 'processing'
+    
+    Background results and stale-row expiry race for the same rows; whichever
+    writes first wins. When the row has already been finished the instance is
+    refreshed instead. Returns whether the row was updated.
+    """
+    if not type(instance).objects.filter(pk=instance.pk, status='processing').update(**fields):
+        instance.refresh_from_db()
+        return False
+    for name, value in fields.items():
+        setattr(instance, name, value)
+    return True
+
+def _expire_if_stale(instance, timeout: int, **fields) -> bool:
+    """Write fields on a row still 'processing' more than timeout seconds after it was created
+    
+    Returns whether the row was expired.
+    """
+    if instance.status != 'processing' or timezone.now() - instance.timestamp < timedelta(seconds=timeout):
+        return False
+    return _update_if_processing(instance, **fields)
+
 class MCPClient:
     """Client for interacting with the MCP server"""
     
     def __init__(self):
         self.base_url = settings.MCP_SERVER_URL
-        self.session = requests.Session()
+        self.http_client = _http_client
         
     def call_tool(self, session_id: str, tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
-        """Call an MCP tool"""
+        """Call an MCP tool, serving read-only tools from cache when possible"""
+        if tool_name not in READ_ONLY_TOOLS:
+            result = self._call_tool(session_id, tool_name, arguments)
+            if result['success']:
+                self._invalidate_tool_cache()
+            return result
+        
+        cache_key = self._tool_cache_key(tool_name, arguments)
+        data = cache.get(cache_key)
+        if data is not None:
+            logger.info(f"MCP tool call served from cache: {tool_name}")
+            return {
+                'success': True,
+                'data': data,
+                'duration_ms': 0
+            }
+        
+        result = self._call_tool(session_id, tool_name, arguments)
+        # Tool failures come back as 200 responses flagged with isError
+        if result['success'] and not result['data'].get('isError'):
+            cache.set(cache_key, result['data'], TOOL_CACHE_TTL)
+        return result
+    
+    def _tool_cache_key(self, tool_name: str, arguments: Dict[str, Any]) -> str:
+        """Cache key for a read-only tool call within the current cache generation"""
+        generation = cache.get_or_set(_TOOL_CACHE_GENERATION_KEY, 0, None)
+        digest = hashlib.blake2b(orjson.dumps(arguments, option=orjson.OPT_SORT_KEYS)).hexdigest()
+        return f"mcp:{generation}:{tool_name}:{digest}"
+    
+    def _invalidate_tool_cache(self) -> None:
+        """Drop all cached tool results by moving to a new cache generation"""
+        try:
+            cache.incr(_TOOL_CACHE_GENERATION_KEY)
+        except ValueError:
+            cache.set(_TOOL_CACHE_GENERATION_KEY, 1, None)
+    
+    def _call_tool(self, session_id: str, tool_name: str, arguments: Dict[str, Any]) -> Dict[str, Any]:
+        """Call an MCP tool on the server"""
         url = f"{self.base_url}/mcp/message"
         params = {"sessionId": session_id}
         
@@ -31,7 +158,8 @@ class MCPClient:
         
         start_time = time.time()
         try:
-            response = self.session.post(url, params=params, json=payload, timeout=30)
+            response = self.http_client.post(url, params=params, json=payload,
+                                             timeout=httpx.Timeout(MCP_CALL_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT))
             duration_ms = int((time.time() - start_time) * 1000)
             
             if response.status_code == 200:
@@ -50,7 +178,8 @@ class MCPClient:
                     'duration_ms': duration_ms
                 }
                 
-        except requests.exceptions.RequestException as e:
+        # ValueError covers a 200 response whose body is not valid JSON
+        except (httpx.HTTPError, ValueError) as e:
             duration_ms = int((time.time() - start_time) * 1000)
             logger.error(f"MCP tool call exception: {tool_name} - {str(e)}")
             return {
@@ -60,14 +189,26 @@ class MCPClient:
             }
     
     def get_capabilities(self) -> Dict[str, Any]:
-        """Get MCP server capabilities"""
+        """Get MCP server capabilities, cached for CAPABILITIES_CACHE_TTL seconds"""
+        cache_key = f"mcp:capabilities:{self.base_url}"
+        capabilities = cache.get(cache_key)
+        if capabilities is None:
+            capabilities = self._fetch_capabilities()
+            # Only successful responses are cached so outages recover promptly
+            if 'error' not in capabilities:
+                cache.set(cache_key, capabilities, CAPABILITIES_CACHE_TTL)
+        return capabilities
+    
+    def _fetch_capabilities(self) -> Dict[str, Any]:
+        """Fetch capabilities from the MCP server"""
         try:
-            response = self.session.get(f"{self.base_url}/mcp/capabilities", timeout=10)
+            response = self.http_client.get(f"{self.base_url}/mcp/capabilities",
+                                            timeout=httpx.Timeout(10, connect=HTTP_CONNECT_TIMEOUT))
             if response.status_code == 200:
                 return response.json()
             else:
                 return {'error': f"HTTP {response.status_code}"}
-        except requests.exceptions.RequestException as e:
+        except (httpx.HTTPError, ValueError) as e:
             return {'error': str(e)}
 
 class AIService:
@@ -76,9 +217,15 @@ class AIService:
     def __init__(self):
         self.openai_client = None
         if settings.OPENAI_API_KEY:
-            self.openai_client = OpenAI(api_key=settings.OPENAI_API_KEY)
+            # No client-side retries, so a reply never outlives AI_REPLY_TIMEOUT
+            self.openai_client = OpenAI(
+                api_key=settings.OPENAI_API_KEY,
+                timeout=httpx.Timeout(AI_REPLY_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+                max_retries=0
+            )
         
         self.ollama_base_url = settings.OLLAMA_BASE_URL
+        self.http_client = _http_client
         
     def generate_response(self, messages: List[Dict[str, str]], provider: str = 'openai', 
                          model: str = 'gpt-3.5-turbo', **kwargs) -> Dict[str, Any]:
@@ -94,6 +241,56 @@ class AIService:
                 'error': f"Provider {provider} not available or not configured"
             }
     
+    def stream_response(self, messages: List[Dict[str, str]], provider: str = 'openai',
+                        model: str = 'gpt-3.5-turbo', **kwargs) -> Iterator[Dict[str, Any]]:
+        """Generate AI response incrementally
+        
+        Yields {'delta': str} chunks followed by one final result dict shaped
+        like generate_response() but without 'content'. Providers without
+        streaming support yield their full response as a single chunk.
+        """
+        if provider == 'openai' and self.openai_client:
+            yield from self._stream_openai_response(messages, model, **kwargs)
+            return
+        
+        result = self.generate_response(messages, provider, model, **kwargs)
+        if result['success']:
+            yield {'delta': result.pop('content')}
+        yield result
+    
+    def _stream_openai_response(self, messages: List[Dict[str, str]], model: str,
+                                **kwargs) -> Iterator[Dict[str, Any]]:
+        """Stream response using OpenAI"""
+        try:
+            stream = self.openai_client.chat.completions.create(
+                model=model,
+                messages=messages,
+                max_tokens=kwargs.get('max_tokens', 1000),
+                temperature=kwargs.get('temperature', 0.7),
+                stream=True,
+                stream_options={'include_usage': True}
+            )
+            
+            tokens_used = None
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield {'delta': chunk.choices[0].delta.content}
+                if chunk.usage:
+                    tokens_used = chunk.usage.total_tokens
+            
+            yield {
+                'success': True,
+                'model': model,
+                'tokens_used': tokens_used
+            }
+            
+        except Exception as e:
+            logger.error(f"OpenAI API error: {str(e)}")
+            yield {
+                'success': False,
+                'error': str(e)
+            }
+    
     def _generate_openai_response(self, messages: List[Dict[str, str]], model: str, **kwargs) -> Dict[str, Any]:
         """Generate response using OpenAI"""
         try:
@@ -128,7 +325,8 @@ class AIService:
                 "stream": False
             }
             
-            response = requests.post(url, json=payload, timeout=60)
+            response = self.http_client.post(url, json=payload,
+                                             timeout=httpx.Timeout(AI_REPLY_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT))
             
             if response.status_code == 200:
                 result = response.json()
@@ -144,7 +342,7 @@ class AIService:
                     'error': f"Ollama HTTP {response.status_code}: {response.text}"
                 }
                 
-        except requests.exceptions.RequestException as e:
+        except (httpx.HTTPError, ValueError) as e:
             logger.error(f"Ollama API error: {str(e)}")
             return {
                 'success': False,
@@ -155,91 +353,225 @@ class ChatService:
     """Main chat service that orchestrates AI and MCP interactions"""
     
     def __init__(self):
-        self.mcp_client = MCPClient()
+        self.mcp_client = get_mcp_client()
         self.ai_service = AIService()
     
-    def process_message(self, session: ChatSession, user_message: str, user_preferences) -> ChatMessage:
-        """Process a user message and generate AI response"""
+    def process_message(self, session: ChatSession, user_message: str,
+                        user_preferences) -> Tuple[ChatMessage, ChatMessage]:
+        """Process a user message and generate AI response
         
-        # Create user message
-        user_msg = ChatMessage.objects.create(
+        Returns the (user message, assistant message) pair that was created.
+        """
+        user_msg, assistant_msg = self._create_message_pair(session, user_message)
+        self._generate_reply(session, user_message, assistant_msg, user_preferences)
+        return user_msg, assistant_msg
+    
+    def submit_message(self, session: ChatSession, user_message: str,
+                       user_preferences) -> Tuple[ChatMessage, ChatMessage]:
+        """Record a user message and generate the AI response in the background
+        
+        Returns the (user message, assistant message) pair; the assistant
+        message is in 'processing' status until a worker thread completes it.
+        """
+        user_msg, assistant_msg = self._create_message_pair(session, user_message)
+        _chat_executor.submit(
+            self._generate_reply_in_background, session, user_message, assistant_msg, user_preferences
+        )
+        return user_msg, assistant_msg
+    
+    def _create_message_pair(self, session: ChatSession,
+                             user_message: str) -> Tuple[ChatMessage, ChatMessage]:
+        """Create the user message and the (processing) assistant message"""
+        # Both rows are written together in a single INSERT
+        user_msg = ChatMessage(
             session=session,
             role='user',
             content=user_message,
             status='completed'
         )
-        
-        # Create assistant message (initially pending)
-        assistant_msg = ChatMessage.objects.create(
+        assistant_msg = ChatMessage(
             session=session,
             role='assistant',
             content='',
             status='processing'
         )
+        with transaction.atomic():
+            ChatMessage.objects.bulk_create([user_msg, assistant_msg])
+            # Title the session from its first message so get_title() needs no query
+            if not session.title:
+                _update_instance(session, title=user_message[:50])
+        return user_msg, assistant_msg
+    
+    def _generate_reply_in_background(self, session: ChatSession, user_message: str,
+                                      assistant_msg: ChatMessage, user_preferences) -> None:
+        """Worker-thread entry point for _generate_reply"""
+        try:
+            self._generate_reply(session, user_message, assistant_msg, user_preferences)
+        finally:
+            close_old_connections()
+    
+    def _generate_reply(self, session: ChatSession, user_message: str,
+                        assistant_msg: ChatMessage, user_preferences) -> None:
+        """Generate the AI response and store it on the assistant message"""
+        if not ChatMessage.objects.filter(pk=assistant_msg.pk, status='processing').exists():
+            # Expired by message_status while queued; don't pay for the LLM call
+            logger.info(f"Skipping reply for expired message {assistant_msg.pk}")
+            return
         
         try:
-            # Get conversation history
-            messages = self._build_conversation_history(session)
-            
-            # Generate AI response
-            ai_response = self.ai_service.generate_response(
-                messages=messages,
-                provider=user_preferences.preferred_ai_provider,
-                model=self._get_model_for_provider(user_preferences),
-                max_tokens=user_preferences.max_tokens,
-                temperature=user_preferences.temperature
-            )
-            
-            if ai_response['success']:
-                assistant_msg.content = ai_response['content']
-                assistant_msg.model_used = ai_response.get('model', '')
-                assistant_msg.tokens_used = ai_response.get('tokens_used')
-                assistant_msg.status = 'completed'
+            if self._detect_loop(session, user_message):
+                # Don't keep feeding the same failing tool calls back to the model
+                ai_response = {'success': False, 'error': _LOOP_DETECTED_ERROR}
             else:
-                assistant_msg.content = f"Error generating response: {ai_response['error']}"
-                assistant_msg.error_message = ai_response['error']
-                assistant_msg.status = 'error'
-            
-            assistant_msg.save()
-            
-            # Update session
-            session.updated_at = assistant_msg.timestamp
-            if not session.title:
-                session.title = user_message[:50] + "..." if len(user_message) > 50 else user_message
-            session.save()
+                # Get conversation history
+                messages = self._build_conversation_history(session)
+                
+                # Generate AI response
+                ai_response = self.ai_service.generate_response(
+                    messages=messages,
+                    provider=user_preferences.preferred_ai_provider,
+                    model=self._get_model_for_provider(user_preferences),
+                    max_tokens=user_preferences.max_tokens,
+                    temperature=user_preferences.temperature
+                )
             
-            return assistant_msg
+            self._store_reply(session, assistant_msg, ai_response)
             
         except Exception as e:
             logger.error(f"Error processing message: {str(e)}")
-            assistant_msg.content = f"An error occurred while processing your message: {str(e)}"
-            assistant_msg.error_message = str(e)
-            assistant_msg.status = 'error'
-            assistant_msg.save()
-            return assistant_msg
+            _update_if_processing(
+                assistant_msg,
+                content=f"An error occurred while processing your message: {str(e)}",
+                error_message=str(e),
+                status='error'
+            )
+    
+    def stream_message(self, session: ChatSession, user_message: str,
+                       user_preferences) -> Iterator[Dict[str, Any]]:
+        """Process a user message, yielding the AI response as it is generated
+        
+        Yields a 'start' event carrying both messages, 'delta' events with
+        content chunks and a final 'done' event. The assistant message is
+        stored when the stream ends, including when the consumer stops early.
+        """
+        user_msg, assistant_msg = self._create_message_pair(session, user_message)
+        
+        chunks = []
+        ai_response = None
+        try:
+            yield {'event': 'start', 'user_message': user_msg, 'assistant_message': assistant_msg}
+            
+            if self._detect_loop(session, user_message):
+                # Don't keep feeding the same failing tool calls back to the model
+                ai_response = {'success': False, 'error': _LOOP_DETECTED_ERROR}
+            else:
+                messages = self._build_conversation_history(session)
+                for chunk in self.ai_service.stream_response(
+                    messages=messages,
+                    provider=user_preferences.preferred_ai_provider,
+                    model=self._get_model_for_provider(user_preferences),
+                    max_tokens=user_preferences.max_tokens,
+                    temperature=user_preferences.temperature
+                ):
+                    if 'delta' in chunk:
+                        chunks.append(chunk['delta'])
+                        yield {'event': 'delta', 'content': chunk['delta']}
+                    else:
+                        ai_response = chunk
+        except Exception as e:
+            logger.error(f"Error streaming message: {str(e)}")
+            ai_response = {'success': False, 'error': str(e)}
+        finally:
+            if ai_response is None:
+                # The stream was abandoned before the provider finished; keep
+                # whatever was generated but don't mark it as completed
+                ai_response = {
+                    'success': False,
+                    'error': "Response stream was interrupted",
+                    'content': ''.join(chunks)
+                }
+            elif ai_response['success']:
+                ai_response = {**ai_response, 'content': ''.join(chunks)}
+            self._store_reply(session, assistant_msg, ai_response)
+        
+        yield {'event': 'done', 'assistant_message': assistant_msg}
+    
+    def _store_reply(self, session: ChatSession, assistant_msg: ChatMessage,
+                     ai_response: Dict[str, Any]) -> None:
+        """Store an AI response on the assistant message and touch the session
+        
+        Nothing is stored if the message was already expired by message_status.
+        """
+        if ai_response['success']:
+            stored = _update_if_processing(
+                assistant_msg,
+                content=ai_response['content'],
+                model_used=ai_response.get('model', ''),
+                tokens_used=ai_response.get('tokens_used'),
+                status='completed'
+            )
+        else:
+            stored = _update_if_processing(
+                assistant_msg,
+                content=ai_response.get('content') or f"Error generating response: {ai_response['error']}",
+                error_message=ai_response['error'],
+                status='error'
+            )
+        if not stored:
+            logger.warning(f"Discarding late reply for expired message {assistant_msg.pk}")
+            return
+        
+        # Update session
+        _update_instance(session, updated_at=timezone.now())
+    
+    def _detect_loop(self, session: ChatSession, user_message: str) -> bool:
+        """Check whether this turn repeats a recent failing turn too often
+        
+        A turn is fingerprinted by the user message plus the type and error of
+        the last 3 MCP operations since the previous user message; fingerprints
+        are only tracked while one of those operations has failed. The most
+        recent LOOP_HASH_HISTORY fingerprints are kept in
+        session.metadata['loop_hashes'].
+        """
+        # The current user message is already stored, so skip it
+        previous_user_message_at = ChatMessage.objects.filter(
+            session_id=session.id, role='user'
+        ).order_by('-timestamp').values('timestamp')[1:2]
+        recent_ops = list(MCPOperation.objects.filter(
+            message__session_id=session.id,
+            timestamp__gt=Subquery(previous_user_message_at)
+        ).order_by('-timestamp').values_list('operation_type', 'error_details')[:3])
+        
+        if not any(error_details for _, error_details in recent_ops):
+            return False
+        
+        fingerprint = hashlib.blake2b(
+            json.dumps([user_message, recent_ops]).encode(), digest_size=16
+        ).hexdigest()
+        
+        loop_hashes = session.metadata.get('loop_hashes', [])[-(LOOP_HASH_HISTORY - 1):]
+        loop_hashes.append(fingerprint)
+        _update_instance(session, metadata={**session.metadata, 'loop_hashes': loop_hashes})
+        
+        if loop_hashes.count(fingerprint) >= LOOP_REPEAT_LIMIT:
+            logger.warning(f"Loop detected in session {session.id}; skipping AI call")
+            return True
+        return False
     
     def _build_conversation_history(self, session: ChatSession) -> List[Dict[str, str]]:
         """Build conversation history for AI context"""
-        messages = []
-        
         # Add system message
-        messages.append({
-            "role": "system",
-            "content": "You are a helpful AI assistant with access to a chat datastore via MCP tools. You can store and retrieve information using KV operations and query document collections."
-        })
+        messages = [_SYSTEM_MESSAGE]
         
-        # Add recent conversation history (last 20 messages)
-        recent_messages = session.messages.filter(
+        # Add recent conversation history (last 20 messages), fetching only
+        # the columns the model needs
+        recent_messages = list(session.messages.filter(
             status='completed'
-        ).order_by('-timestamp')[:20]
+        ).order_by('-timestamp').values('role', 'content')[:20])
         # Reverse to get chronological order
-        recent_messages = list(reversed(recent_messages))
+        recent_messages.reverse()
         
-        for msg in recent_messages:
-            messages.append({
-                "role": msg.role,
-                "content": msg.content
-            })
+        messages.extend(recent_messages)
         
         return messages
     
@@ -251,36 +583,130 @@ class ChatService:
             return user_preferences.ollama_model
     
     def call_mcp_tool(self, message: ChatMessage, tool_name: str, arguments: Dict[str, Any]) -> MCPOperation:
-        """Call an MCP tool and record the operation"""
+        """Start an MCP tool call in the background and record the operation
+        
+        The operation is returned in 'processing' status; its outcome, and the
+        status of the tracking message, are written once the call completes.
+        """
         
         operation = MCPOperation.objects.create(
             message=message,
             operation_type=tool_name,
             parameters=arguments,
-            status='success'  # Will be updated based on result
+            status='processing'
         )
         
+        _mcp_executor.submit(self._run_mcp_tool, operation)
+        return operation
+    
+    def _run_mcp_tool(self, operation: MCPOperation) -> None:
+        """Execute a started MCP tool call and record its result"""
+        tool_name = operation.operation_type
         try:
             # Use session ID from the chat session
-            session_id = str(message.session.id)
+            session_id = str(operation.message.session_id)
             
-            result = self.mcp_client.call_tool(session_id, tool_name, arguments)
-            
-            operation.response = result.get('data', {})
-            operation.duration_ms = result.get('duration_ms')
+            result = self.mcp_client.call_tool(session_id, tool_name, operation.parameters)
             
             if result['success']:
-                operation.status = 'success'
+                stored = _update_if_processing(
+                    operation,
+                    response=result.get('data', {}),
+                    duration_ms=result.get('duration_ms'),
+                    status='success'
+                )
             else:
-                operation.status = 'error'
-                operation.error_details = result.get('error', 'Unknown error')
+                stored = _update_if_processing(
+                    operation,
+                    duration_ms=result.get('duration_ms'),
+                    status='error',
+                    error_details=result.get('error', 'Unknown error')
+                )
+            if not stored:
+                # Already reported as timed out by operation_status
+                logger.warning(f"Discarding late result for expired operation {operation.pk}")
+                return
             
-            operation.save()
-            return operation
+            # Update tracking message
+            _update_instance(
+                operation.message,
+                content=f"MCP tool call: {tool_name} - {operation.status}",
+                status='completed' if operation.status == 'success' else 'error',
+                error_message=operation.error_details
+            )
             
         except Exception as e:
             logger.error(f"Error calling MCP tool {tool_name}: {str(e)}")
-            operation.status = 'error'
-            operation.error_details = str(e)
-            operation.save()
-            return operation
+            if MCPOperation.objects.filter(pk=operation.pk, status='processing').update(
+                status='error', error_details=str(e)
+            ):
+                ChatMessage.objects.filter(pk=operation.message_id).update(status='error', error_message=str(e))
+        finally:
+            # Worker threads don't go through the request cycle that normally
+            # releases connections
+            close_old_connections()
+    
+    def expire_stale_operation(self, operation: MCPOperation) -> None:
+        """Mark an operation whose background call was lost as timed out"""
+        error = f"No result after {MCP_CALL_TIMEOUT}s"
+        if _expire_if_stale(operation, MCP_CALL_TIMEOUT, status='timeout', error_details=error):
+            ChatMessage.objects.filter(pk=operation.message_id, status='processing').update(
+                content=f"MCP tool call: {operation.operation_type} - timeout",
+                status='error',
+                error_message=error
+            )
+    
+    def expire_stale_message(self, message: ChatMessage) -> None:
+        """Mark a message whose background reply was lost as failed"""
+        error = f"No response after {AI_REPLY_TIMEOUT}s"
+        _expire_if_stale(
+            message, AI_REPLY_TIMEOUT,
+            content=f"Error generating response: {error}",
+            status='error',
+            error_message=error
+        )
+    
+    def call_mcp_tools_batch(self, message: ChatMessage,
+                             calls: List[Tuple[str, Dict[str, Any]]]) -> List[MCPOperation]:
+        """Call independent MCP tools concurrently and record the operations in input order"""
+        session_id = str(message.session_id)
+        
+        futures = {
+            _mcp_executor.submit(self.mcp_client.call_tool, session_id, tool_name, arguments): index
+            for index, (tool_name, arguments) in enumerate(calls)
+        }
+        
+        results: List[Optional[Dict[str, Any]]] = [None] * len(calls)
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                results[index] = future.result()
+            except Exception as e:
+                logger.error(f"Error calling MCP tool {calls[index][0]}: {str(e)}")
+                results[index] = {'success': False, 'error': str(e)}
+        
+        operations = []
+        for (tool_name, arguments), result in zip(calls, results):
+            operations.append(MCPOperation(
+                message=message,
+                operation_type=tool_name,
+                parameters=arguments,
+                response=result.get('data', {}),
+                duration_ms=result.get('duration_ms'),
+                status='success' if result['success'] else 'error',
+                error_details='' if result['success'] else result.get('error', 'Unknown error')
+            ))
+        
+        return MCPOperation.objects.bulk_create(operations)
+
+
+@lru_cache(maxsize=1)
+def get_mcp_client() -> MCPClient:
+    """Return the process-wide MCP client so its connection pool is reused"""
+    return MCPClient()
+
+
+@lru_cache(maxsize=1)
+def get_chat_service() -> ChatService:
+    """Return the process-wide chat service"""
+    return ChatService()
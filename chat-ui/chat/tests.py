@@ -1,3 +1,362 @@
+from datetime import timedelta
+from unittest import mock
+
+import httpx
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.test import TestCase
+from django.utils import timezone
+
+from .models import ChatMessage, ChatSession, MCPOperation, UserPreferences
+from .services import ChatService, MCPClient
+
+
+def _html_transport(request):
+    return httpx.Response(200, text='<html>Bad Gateway</html>')
+
+
+class MCPClientTimeoutTests(TestCase):
+    def test_calls_keep_short_connect_timeout(self):
+        seen = []
+
+        def transport(request):
+            seen.append(request.extensions['timeout'])
+            return httpx.Response(200, json={})
+
+        cache.clear()
+        mcp_client = MCPClient()
+        mcp_client.http_client = httpx.Client(transport=httpx.MockTransport(transport))
+        mcp_client.call_tool('sid', 'kv_set', {'key': 'a'})
+        mcp_client.get_capabilities()
+        self.assertEqual([timeout['connect'] for timeout in seen], [2, 2])
+        self.assertEqual([timeout['read'] for timeout in seen], [30, 10])
+
+
+class MCPClientTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client_under_test = MCPClient()
+        self.client_under_test.http_client = httpx.Client(transport=httpx.MockTransport(_html_transport))
+
+    def test_call_tool_reports_non_json_body_as_error(self):
+        result = self.client_under_test.call_tool('sid', 'kv_get', {'key': 'a'})
+        self.assertFalse(result['success'])
+        self.assertIn('error', result)
+
+    def test_get_capabilities_reports_non_json_body_as_error(self):
+        self.assertIn('error', self.client_under_test.get_capabilities())
+
+    def test_capabilities_view_handles_non_json_body(self):
+        user = User.objects.create(username='caps')
+        self.client.force_login(user)
+        with mock.patch('chat.views.get_mcp_client', return_value=self.client_under_test):
+            response = self.client.get('/api/mcp/capabilities/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('error', response.json())
+
+    def test_capabilities_view_fetches_upstream_once_during_outage(self):
+        calls = []
+
+        def transport(request):
+            calls.append(request)
+            return httpx.Response(503, text='unavailable')
+
+        self.client_under_test.http_client = httpx.Client(transport=httpx.MockTransport(transport))
+        self.client.force_login(User.objects.create(username='outage'))
+        with mock.patch('chat.views.get_mcp_client', return_value=self.client_under_test):
+            response = self.client.get('/api/mcp/capabilities/')
+        self.assertIn('error', response.json())
+        self.assertEqual(len(calls), 1)
+
+class MCPToolCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.calls = 0
+
+    def _client(self, payload):
+        def transport(request):
+            self.calls += 1
+            return httpx.Response(200, json=payload)
+
+        mcp_client = MCPClient()
+        mcp_client.http_client = httpx.Client(transport=httpx.MockTransport(transport))
+        return mcp_client
+
+    def test_read_only_results_are_cached(self):
+        mcp_client = self._client({'content': [{'type': 'text', 'text': 'v'}]})
+        mcp_client.call_tool('sid', 'kv_get', {'key': 'a'})
+        mcp_client.call_tool('sid', 'kv_get', {'key': 'a'})
+        self.assertEqual(self.calls, 1)
+
+    def test_tool_errors_are_not_cached(self):
+        mcp_client = self._client({'isError': True, 'content': [{'type': 'text', 'text': 'boom'}]})
+        mcp_client.call_tool('sid', 'kv_get', {'key': 'a'})
+        mcp_client.call_tool('sid', 'kv_get', {'key': 'a'})
+        self.assertEqual(self.calls, 2)
+
+
+class CallMCPToolsViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='batch')
+        self.client.force_login(self.user)
+        self.session = ChatSession.objects.create(user=self.user)
+        self.url = f'/api/sessions/{self.session.id}/mcp-tools/'
+
+    def test_rejects_non_object_arguments_before_dispatch(self):
+        with mock.patch('chat.services.MCPClient.call_tool') as call_tool:
+            response = self.client.post(self.url, {
+                'calls': [
+                    {'tool_name': 'kv_get', 'arguments': {'key': 'a'}},
+                    {'tool_name': 'kv_del', 'arguments': None},
+                ]
+            }, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        call_tool.assert_not_called()
+        self.assertFalse(ChatMessage.objects.filter(session=self.session).exists())
+
+    def test_records_operations_in_input_order(self):
+        def fake_call_tool(session_id, tool_name, arguments):
+            if tool_name == 'kv_del':
+                return {'success': False, 'error': 'boom', 'duration_ms': 1}
+            return {'success': True, 'data': {'tool': tool_name}, 'duration_ms': 1}
+
+        with mock.patch('chat.services.MCPClient.call_tool', side_effect=fake_call_tool):
+            response = self.client.post(self.url, {
+                'calls': [{'tool_name': 'kv_get', 'arguments': {'key': 'a'}}, {'tool_name': 'kv_del'}]
+            }, content_type='application/json')
+        data = response.json()
+        self.assertFalse(data['success'])
+        self.assertEqual([op['tool_name'] for op in data['operations']], ['kv_get', 'kv_del'])
+        self.assertEqual(MCPOperation.objects.filter(message__session=self.session).count(), 2)
+
+
+class StreamMessageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='stream')
+        self.session = ChatSession.objects.create(user=self.user)
+        self.preferences = UserPreferences.objects.create(user=self.user)
+        self.service = ChatService()
+
+    def test_interrupted_stream_is_stored_as_error_with_partial_content(self):
+        def stream_response(**kwargs):
+            yield {'delta': 'Hel'}
+            yield {'delta': 'lo'}
+            yield {'success': True, 'model': 'gpt', 'tokens_used': 3}
+
+        with mock.patch.object(self.service.ai_service, 'stream_response', side_effect=stream_response):
+            events = self.service.stream_message(self.session, 'hi', self.preferences)
+            start = next(events)
+            next(events)
+            events.close()
+
+        assistant_msg = ChatMessage.objects.get(id=start['assistant_message'].id)
+        self.assertEqual(assistant_msg.status, 'error')
+        self.assertEqual(assistant_msg.error_message, 'Response stream was interrupted')
+        self.assertEqual(assistant_msg.content, 'Hel')
+
+    def test_stream_closed_at_start_is_stored_as_interrupted(self):
+        events = self.service.stream_message(self.session, 'hi', self.preferences)
+        start = next(events)
+        events.close()
+
+        assistant_msg = ChatMessage.objects.get(id=start['assistant_message'].id)
+        self.assertEqual(assistant_msg.status, 'error')
+        self.assertEqual(assistant_msg.error_message, 'Response stream was interrupted')
+
+    def test_view_reports_message_creation_failure_as_json(self):
+        self.client.force_login(self.user)
+        with mock.patch.object(ChatService, '_create_message_pair', side_effect=RuntimeError('db down')):
+            response = self.client.post(
+                f'/api/sessions/{self.session.id}/stream/', {'message': 'hi'},
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, 500)
+        self.assertEqual(response.json()['error'], 'db down')
+
+    def test_finished_stream_is_stored_as_completed(self):
+        def stream_response(**kwargs):
+            yield {'delta': 'Hel'}
+            yield {'delta': 'lo'}
+            yield {'success': True, 'model': 'gpt', 'tokens_used': 3}
+
+        with mock.patch.object(self.service.ai_service, 'stream_response', side_effect=stream_response):
+            events = list(self.service.stream_message(self.session, 'hi', self.preferences))
+
+        assistant_msg = ChatMessage.objects.get(id=events[-1]['assistant_message'].id)
+        self.assertEqual(assistant_msg.status, 'completed')
+        self.assertEqual(assistant_msg.content, 'Hello')
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='pages')
+        self.client.force_login(self.user)
+        self.session = ChatSession.objects.create(user=self.user)
+        self.url = f'/api/sessions/{self.session.id}/history/'
+
+    def _create_messages(self, count):
+        ChatMessage.objects.bulk_create(
+            ChatMessage(session=self.session, role='user', content=str(i)) for i in range(count)
+        )
+
+    def _walk(self, limit):
+        ids, cursor = [], None
+        while True:
+            params = {'limit': limit}
+            if cursor:
+                params['cursor'] = cursor
+            data = self.client.get(self.url, params).json()
+            ids.extend(message['id'] for message in data['messages'])
+            cursor = data['next_cursor']
+            if not cursor:
+                return ids
+
+    def test_pages_cover_every_message_once(self):
+        self._create_messages(5)
+        ids = self._walk(limit=2)
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(len(set(ids)), 5)
+
+    def test_messages_sharing_a_timestamp_are_not_skipped(self):
+        self._create_messages(4)
+        ChatMessage.objects.filter(session=self.session).update(timestamp=timezone.now())
+        ids = self._walk(limit=2)
+        self.assertEqual(len(ids), 4)
+        self.assertEqual(len(set(ids)), 4)
+
+    def test_invalid_cursor_or_limit_is_rejected(self):
+        for params in ({'cursor': 'yesterday'}, {'cursor': '2024-01-01T00:00:00+00:00,nope'},
+                       {'limit': 'ten'}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 400, params)
+
+
+class StaleOperationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='stale-ops')
+        self.client.force_login(self.user)
+        session = ChatSession.objects.create(user=self.user)
+        self.message = ChatMessage.objects.create(session=session, role='system', status='processing')
+        self.operation = MCPOperation.objects.create(
+            message=self.message, operation_type='kv_get', parameters={}, status='processing'
+        )
+
+    def test_recent_operation_stays_processing(self):
+        data = self.client.get(f'/api/operations/{self.operation.id}/').json()
+        self.assertEqual(data['status'], 'processing')
+
+    def test_stale_operation_is_reported_and_stored_as_timeout(self):
+        MCPOperation.objects.filter(pk=self.operation.pk).update(
+            timestamp=timezone.now() - timedelta(seconds=31)
+        )
+        data = self.client.get(f'/api/operations/{self.operation.id}/').json()
+        self.assertEqual(data['status'], 'timeout')
+        self.operation.refresh_from_db()
+        self.message.refresh_from_db()
+        self.assertEqual(self.operation.status, 'timeout')
+        self.assertEqual(self.message.status, 'error')
+
+    def test_late_result_does_not_overwrite_expired_operation(self):
+        MCPOperation.objects.filter(pk=self.operation.pk).update(
+            timestamp=timezone.now() - timedelta(seconds=31)
+        )
+        self.client.get(f'/api/operations/{self.operation.id}/')
+        service = ChatService()
+        result = {'success': True, 'data': {'value': 'late'}, 'duration_ms': 40000}
+        with mock.patch.object(service.mcp_client, 'call_tool', return_value=result):
+            service._run_mcp_tool(self.operation)
+        self.operation.refresh_from_db()
+        self.message.refresh_from_db()
+        self.assertEqual(self.operation.status, 'timeout')
+        self.assertEqual(self.message.status, 'error')
+
+
+class StaleMessageTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='stale-messages')
+        self.client.force_login(self.user)
+        self.session = ChatSession.objects.create(user=self.user)
+        self.message = ChatMessage.objects.create(session=self.session, role='assistant', status='processing')
+        self.url = f'/api/sessions/{self.session.id}/messages/{self.message.id}/'
+
+    def test_recent_reply_stays_processing(self):
+        data = self.client.get(self.url).json()
+        self.assertEqual(data['message']['status'], 'processing')
+
+    def test_stale_reply_is_reported_and_stored_as_error(self):
+        ChatMessage.objects.filter(pk=self.message.pk).update(
+            timestamp=timezone.now() - timedelta(seconds=61)
+        )
+        data = self.client.get(self.url).json()
+        self.assertEqual(data['message']['status'], 'error')
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, 'error')
+
+    def test_late_reply_does_not_overwrite_expired_message(self):
+        ChatMessage.objects.filter(pk=self.message.pk).update(
+            timestamp=timezone.now() - timedelta(seconds=61)
+        )
+        self.client.get(self.url)
+        ChatService()._store_reply(self.session, self.message, {'success': True, 'content': 'late'})
+        self.message.refresh_from_db()
+        self.assertEqual(self.message.status, 'error')
+
+    def test_expired_message_is_not_sent_to_the_provider(self):
+        ChatMessage.objects.filter(pk=self.message.pk).update(status='error')
+        service = ChatService()
+        preferences = UserPreferences.objects.create(user=self.user)
+        with mock.patch.object(service.ai_service, 'generate_response') as generate_response:
+            service._generate_reply(self.session, 'hi', self.message, preferences)
+        generate_response.assert_not_called()
+
+
+class LoopDetectionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='loops')
+        self.session = ChatSession.objects.create(user=self.user)
+        self.service = ChatService()
+
+    def _user_turn(self, content='retry it'):
+        ChatMessage.objects.create(session=self.session, role='user', content=content)
+        return self.service._detect_loop(self.session, content)
+
+    def _failed_operation(self):
+        message = ChatMessage.objects.create(session=self.session, role='system', status='error')
+        MCPOperation.objects.create(
+            message=message, operation_type='kv_get', parameters={}, status='error',
+            error_details='connection refused'
+        )
+
+    def test_repeated_failing_turns_trip_the_breaker(self):
+        self.assertFalse(self._user_turn())
+        results = []
+        for _ in range(3):
+            self._failed_operation()
+            results.append(self._user_turn())
+        self.assertEqual(results, [False, False, True])
+
+    def test_old_failure_does_not_trip_the_breaker(self):
+        self._user_turn()
+        self._failed_operation()
+        results = [self._user_turn() for _ in range(4)]
+        self.assertEqual(results, [False, False, False, False])
+
+
+class ChatListTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='lister')
+        self.client.force_login(self.user)
+
+    def test_long_last_message_preview_is_truncated_with_ellipsis(self):
+        session = ChatSession.objects.create(user=self.user, title='Long one')
+        ChatMessage.objects.create(session=session, role='user', content='x' * 200)
+        response = self.client.get('/sessions/')
+        self.assertContains(response, 'x' * 79 + '…')
+        self.assertNotContains(response, 'x' * 80)
 
-# Create your tests here.
+    def test_sessions_are_paginated_newest_first(self):
+        sessions = [ChatSession.objects.create(user=self.user, title=f'S{i}') for i in range(25)]
+        response = self.client.get('/sessions/')
+        page = response.context['page_obj']
+        self.assertEqual(page.paginator.count, 25)
+        self.assertEqual([s.id for s in page.object_list], [s.id for s in reversed(sessions)][:20])
@@ -13,10 +13,14 @@ urlpatterns = [
     
     # API endpoints
     path('api/sessions/<uuid:session_id>/send/', views.send_message, name='send_message'),
+    path('api/sessions/<uuid:session_id>/stream/', views.stream_message, name='stream_message'),
+    path('api/sessions/<uuid:session_id>/messages/<uuid:message_id>/', views.message_status, name='message_status'),
     path('api/sessions/<uuid:session_id>/history/', views.session_history, name='session_history'),
     path('api/sessions/<uuid:session_id>/operations/', views.session_operations, name='session_operations'),
     path('api/sessions/<uuid:session_id>/mcp-tool/', views.call_mcp_tool, name='call_mcp_tool'),
+    path('api/sessions/<uuid:session_id>/mcp-tools/', views.call_mcp_tools, name='call_mcp_tools'),
     path('api/sessions/<uuid:session_id>/delete/', views.delete_session, name='delete_session'),
+    path('api/operations/<uuid:operation_id>/', views.operation_status, name='operation_status'),
     
     # Settings and capabilities
     path('api/preferences/', views.update_preferences, name='update_preferences'),
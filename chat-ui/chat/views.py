@@ -2,20 +2,96 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth import login
 from django.contrib.auth.models import User
-from django.http import JsonResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from django.views.decorators.http import require_http_methods
+from django.views.decorators.gzip import gzip_page
+from django.views.decorators.http import condition, require_http_methods
 from django.utils.decorators import method_decorator
 from django.views import View
 from django.core.paginator import Paginator
-import json
+from django.db.models import Count, Max, OuterRef, Q, Subquery
+from django.db.models.functions import Left
+from django.utils.dateparse import parse_datetime
+import hashlib
+import itertools
 import logging
+import uuid
+import orjson
 
 from .models import ChatSession, ChatMessage, UserPreferences, MCPOperation
-from .services import ChatService, MCPClient
+from .services import get_chat_service, get_mcp_client
 
 logger = logging.getLogger('chat')
 
+# Page sizes for the keyset-paginated history/operations endpoints
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# UserPreferences fields clients may update
+_PREFERENCE_FIELDS = frozenset({
+    'preferred_ai_provider', 'openai_model', 'ollama_model', 'max_tokens',
+    'temperature', 'theme', 'show_timestamps', 'show_token_usage',
+    'show_mcp_operations',
+})
+
+_loads = orjson.loads
+
+def _json(data, status=200):
+    """Serialize data with orjson; UUIDs and datetimes are encoded natively"""
+    return HttpResponse(orjson.dumps(data, default=str), content_type='application/json', status=status)
+
+def _keyset_page(queryset, request):
+    """Return one page of rows, newest first, and the cursor for the next page
+    
+    Rows are ordered by (timestamp, id) so rows sharing a timestamp are never
+    skipped. ``?cursor=`` is the ``next_cursor`` returned by the previous page
+    (``<timestamp>,<id>``) and ``?limit=`` the page size. Raises ValueError for
+    bad parameters.
+    """
+    limit = max(1, min(int(request.GET.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE))
+    cursor = request.GET.get('cursor')
+    if cursor:
+        # An unencoded '+' in the UTC offset arrives as a space
+        cursor_timestamp, _, cursor_id = cursor.replace(' ', '+').rpartition(',')
+        cursor_timestamp = parse_datetime(cursor_timestamp)
+        if cursor_timestamp is None:
+            raise ValueError(f"Invalid cursor: {cursor}")
+        cursor_id = uuid.UUID(cursor_id)
+        queryset = queryset.filter(
+            Q(timestamp__lt=cursor_timestamp) | Q(timestamp=cursor_timestamp, id__lt=cursor_id)
+        )
+    
+    # Fetch one extra row to learn whether another page exists
+    rows = list(queryset.order_by('-timestamp', '-id')[:limit + 1])
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = f"{last['timestamp'].isoformat()},{last['id']}"
+    return rows[:limit], next_cursor
+
+def _message_payload(message):
+    """Serialize the fields of a chat message reported to the client"""
+    return {
+        'id': message.id,
+        'content': message.content,
+        'timestamp': message.timestamp,
+        'status': message.status,
+        'model_used': message.model_used,
+        'tokens_used': message.tokens_used
+    }
+
+def _sse_frame(event):
+    """Encode a ChatService.stream_message event as a server-sent event frame"""
+    if 'user_message' in event:
+        event = {**event, 'user_message': {
+            'id': event['user_message'].id,
+            'content': event['user_message'].content,
+            'timestamp': event['user_message'].timestamp
+        }}
+    if 'assistant_message' in event:
+        event = {**event, 'assistant_message': _message_payload(event['assistant_message'])}
+    return b'data: ' + orjson.dumps(event, default=str) + b'\n\n'
+
 def home(request):
     """Home page - redirect to chat if authenticated, otherwise show login"""
     if request.user.is_authenticated:
@@ -25,6 +101,7 @@ def home(request):
 @login_required
 def chat_list(request):
     """List all chat sessions for the user"""
+    # Paginate the plain queryset so the page count stays a simple COUNT(*)
     sessions = ChatSession.objects.filter(
         user=request.user,
         is_active=True
@@ -34,6 +111,21 @@ def chat_list(request):
     page_number = request.GET.get('page')
     page_obj = paginator.get_page(page_number)
     
+    # Message stats and the last-message preview are computed for the page's
+    # sessions in one query so the template doesn't issue per-session
+    # queries. The JSON metadata column is never rendered; skip
+    # loading/decoding it. The preview keeps one character more than the
+    # template shows so truncatechars still adds the ellipsis.
+    last_message = ChatMessage.objects.filter(session=OuterRef('pk')).order_by('-timestamp')
+    page_obj.object_list = list(ChatSession.objects.filter(
+        id__in=list(page_obj.object_list.values_list('id', flat=True))
+    ).select_related('user').defer('metadata').annotate(
+        msg_count=Count('messages'),
+        last_msg_at=Max('messages__timestamp'),
+        last_msg_role=Subquery(last_message.values('role')[:1]),
+        last_msg_preview=Subquery(last_message.values(preview=Left('content', 81))[:1])
+    ).order_by('-updated_at'))
+    
     return render(request, 'chat/chat_list.html', {
         'page_obj': page_obj,
         'sessions': page_obj.object_list
@@ -43,13 +135,15 @@ def chat_list(request):
 def chat_session(request, session_id=None):
     """Chat session view"""
     if session_id:
-        session = get_object_or_404(ChatSession, id=session_id, user=request.user)
+        session = get_object_or_404(
+            ChatSession.objects.defer('metadata'), id=session_id, user=request.user
+        )
     else:
         # Create new session
         session = ChatSession.objects.create(user=request.user)
         return redirect('chat:chat_session', session_id=session.id)
     
-    messages = session.messages.order_by('timestamp')
+    messages = session.messages.defer('mcp_operations').order_by('timestamp')
     
     # Get or create user preferences
     preferences, created = UserPreferences.objects.get_or_create(user=request.user)
@@ -68,65 +162,108 @@ def send_message(request, session_id):
     try:
         session = get_object_or_404(ChatSession, id=session_id, user=request.user)
         
-        data = json.loads(request.body)
+        data = _loads(request.body)
         user_message = data.get('message', '').strip()
         
         if not user_message:
-            return JsonResponse({'error': 'Message cannot be empty'}, status=400)
+            return _json({'error': 'Message cannot be empty'}, status=400)
         
         # Get user preferences
         preferences, created = UserPreferences.objects.get_or_create(user=request.user)
         
-        # Process the message
-        chat_service = ChatService()
-        assistant_message = chat_service.process_message(session, user_message, preferences)
+        # Queue the message; the reply is fetched via message_status
+        chat_service = get_chat_service()
+        user_msg, assistant_message = chat_service.submit_message(session, user_message, preferences)
         
         # Return the response
-        return JsonResponse({
+        return _json({
             'success': True,
             'user_message': {
-                'id': str(assistant_message.session.messages.filter(role='user').last().id),
+                'id': user_msg.id,
                 'content': user_message,
-                'timestamp': assistant_message.session.messages.filter(role='user').last().timestamp.isoformat()
+                'timestamp': user_msg.timestamp
             },
-            'assistant_message': {
-                'id': str(assistant_message.id),
-                'content': assistant_message.content,
-                'timestamp': assistant_message.timestamp.isoformat(),
-                'status': assistant_message.status,
-                'model_used': assistant_message.model_used,
-                'tokens_used': assistant_message.tokens_used
-            }
-        })
+            'assistant_message': _message_payload(assistant_message)
+        }, status=202)
         
     except Exception as e:
         logger.error(f"Error sending message: {str(e)}")
-        return JsonResponse({'error': str(e)}, status=500)
+        return _json({'error': str(e)}, status=500)
 
 @login_required
+@require_http_methods(["POST"])
+@csrf_exempt
+def stream_message(request, session_id):
+    """Send a message and stream the AI response as server-sent events"""
+    try:
+        session = get_object_or_404(ChatSession, id=session_id, user=request.user)
+        
+        data = _loads(request.body)
+        user_message = data.get('message', '').strip()
+        
+        if not user_message:
+            return _json({'error': 'Message cannot be empty'}, status=400)
+        
+        # Get user preferences
+        preferences, created = UserPreferences.objects.get_or_create(user=request.user)
+        
+        chat_service = get_chat_service()
+        events = chat_service.stream_message(session, user_message, preferences)
+        # Store the messages now, so failures get a JSON 500 instead of
+        # breaking the stream after the response has started
+        start = next(events)
+        
+        response = StreamingHttpResponse(
+            (_sse_frame(event) for event in itertools.chain([start], events)),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        # Keep reverse proxies from buffering the stream
+        response['X-Accel-Buffering'] = 'no'
+        return response
+        
+    except Exception as e:
+        logger.error(f"Error streaming message: {str(e)}")
+        return _json({'error': str(e)}, status=500)
+
+@login_required
+def message_status(request, session_id, message_id):
+    """Get the current state of a message, e.g. to poll for an AI reply"""
+    message = get_object_or_404(
+        ChatMessage, id=message_id, session_id=session_id, session__user=request.user
+    )
+    get_chat_service().expire_stale_message(message)
+    
+    return _json({
+        'success': True,
+        'message': _message_payload(message)
+    })
+
+@login_required
+@gzip_page
 def session_history(request, session_id):
     """Get session message history as JSON"""
     session = get_object_or_404(ChatSession, id=session_id, user=request.user)
     
-    messages = session.messages.order_by('timestamp')
+    # Plain rows instead of a hydrated ChatMessage per row
+    messages = session.messages.values(
+        'id', 'role', 'content', 'timestamp', 'status',
+        'model_used', 'tokens_used', 'error_message'
+    )
     
-    message_data = []
-    for msg in messages:
-        message_data.append({
-            'id': str(msg.id),
-            'role': msg.role,
-            'content': msg.content,
-            'timestamp': msg.timestamp.isoformat(),
-            'status': msg.status,
-            'model_used': msg.model_used,
-            'tokens_used': msg.tokens_used,
-            'error_message': msg.error_message
-        })
+    try:
+        message_data, next_cursor = _keyset_page(messages, request)
+    except ValueError as e:
+        return _json({'error': str(e)}, status=400)
+    
+    # Pages walk backwards in time; messages within a page are chronological
+    message_data.reverse()
     
-    return JsonResponse({
-        'session_id': str(session.id),
+    return _json({
+        'session_id': session.id,
         'title': session.get_title(),
-        'messages': message_data
+        'messages': message_data,
+        'next_cursor': next_cursor
     })
 
 @login_required
@@ -137,12 +274,12 @@ def call_mcp_tool(request, session_id):
     try:
         session = get_object_or_404(ChatSession, id=session_id, user=request.user)
         
-        data = json.loads(request.body)
+        data = _loads(request.body)
         tool_name = data.get('tool_name')
         arguments = data.get('arguments', {})
         
         if not tool_name:
-            return JsonResponse({'error': 'Tool name is required'}, status=400)
+            return _json({'error': 'Tool name is required'}, status=400)
         
         # Create a system message to track this operation
         system_message = ChatMessage.objects.create(
@@ -152,65 +289,148 @@ def call_mcp_tool(request, session_id):
             status='processing'
         )
         
-        # Call the MCP tool
-        chat_service = ChatService()
+        # Start the MCP tool call; the result is fetched via operation_status
+        chat_service = get_chat_service()
         operation = chat_service.call_mcp_tool(system_message, tool_name, arguments)
         
+        return _json({
+            'success': True,
+            'operation_id': operation.id,
+            'status': operation.status
+        }, status=202)
+        
+    except Exception as e:
+        logger.error(f"Error calling MCP tool: {str(e)}")
+        return _json({'error': str(e)}, status=500)
+
+@login_required
+@require_http_methods(["POST"])
+@csrf_exempt
+def call_mcp_tools(request, session_id):
+    """Call several independent MCP tools concurrently"""
+    try:
+        session = get_object_or_404(ChatSession, id=session_id, user=request.user)
+        
+        data = _loads(request.body)
+        calls = data.get('calls') or []
+        
+        if not isinstance(calls, list) or not calls:
+            return _json({'error': 'At least one call is required'}, status=400)
+        if any(not isinstance(call, dict) or not call.get('tool_name') for call in calls):
+            return _json({'error': 'Tool name is required for every call'}, status=400)
+        if any(not isinstance(call.get('arguments', {}), dict) for call in calls):
+            return _json({'error': 'Arguments must be an object for every call'}, status=400)
+        
+        tool_names = [call['tool_name'] for call in calls]
+        
+        # Create a system message to track this batch of operations
+        system_message = ChatMessage.objects.create(
+            session=session,
+            role='system',
+            content=f"MCP tool calls: {', '.join(tool_names)}",
+            status='processing'
+        )
+        
+        # Call the MCP tools
+        chat_service = get_chat_service()
+        operations = chat_service.call_mcp_tools_batch(
+            system_message,
+            [(call['tool_name'], call.get('arguments', {})) for call in calls]
+        )
+        
         # Update system message
-        system_message.content = f"MCP tool call: {tool_name} - {operation.status}"
-        system_message.status = 'completed' if operation.status == 'success' else 'error'
-        if operation.error_details:
-            system_message.error_message = operation.error_details
-        system_message.save()
-        
-        return JsonResponse({
-            'success': operation.status == 'success',
-            'operation_id': str(operation.id),
-            'response': operation.response,
-            'duration_ms': operation.duration_ms,
-            'error': operation.error_details
+        errors = [op.error_details for op in operations if op.status != 'success']
+        system_message.status = 'error' if errors else 'completed'
+        system_message.error_message = '\n'.join(errors)
+        system_message.save(update_fields=['status', 'error_message'])
+        
+        return _json({
+            'success': not errors,
+            'operations': [
+                {
+                    'operation_id': op.id,
+                    'tool_name': op.operation_type,
+                    'success': op.status == 'success',
+                    'response': op.response,
+                    'duration_ms': op.duration_ms,
+                    'error': op.error_details
+                }
+                for op in operations
+            ]
         })
         
     except Exception as e:
-        logger.error(f"Error calling MCP tool: {str(e)}")
-        return JsonResponse({'error': str(e)}, status=500)
+        logger.error(f"Error calling MCP tools: {str(e)}")
+        return _json({'error': str(e)}, status=500)
+
+def _request_capabilities(request):
+    """MCP capabilities fetched at most once per request
+    
+    Errors are not cached by MCPClient, so without this an outage would cost
+    one upstream call for the ETag and another for the response body.
+    """
+    if not hasattr(request, '_mcp_capabilities'):
+        request._mcp_capabilities = get_mcp_client().get_capabilities()
+    return request._mcp_capabilities
+
+def _capabilities_etag(request):
+    """ETag for the (cached) MCP capabilities so clients can revalidate with 304s"""
+    capabilities = _request_capabilities(request)
+    if 'error' in capabilities:
+        return None
+    return hashlib.md5(orjson.dumps(capabilities, option=orjson.OPT_SORT_KEYS)).hexdigest()
 
 @login_required
+@condition(etag_func=_capabilities_etag)
 def mcp_capabilities(request):
     """Get MCP server capabilities"""
     try:
-        mcp_client = MCPClient()
-        capabilities = mcp_client.get_capabilities()
-        return JsonResponse(capabilities)
+        return _json(_request_capabilities(request))
     except Exception as e:
         logger.error(f"Error getting MCP capabilities: {str(e)}")
-        return JsonResponse({'error': str(e)}, status=500)
+        return _json({'error': str(e)}, status=500)
 
 @login_required
+@gzip_page
 def session_operations(request, session_id):
     """Get MCP operations for a session"""
     session = get_object_or_404(ChatSession, id=session_id, user=request.user)
     
+    # Fetch only the serialized columns in a single query; no model instances
+    # (and therefore no lazy message lookups) are created per row.
     operations = MCPOperation.objects.filter(
-        message__session=session
-    ).order_by('-timestamp')
+        message__session_id=session.id
+    ).values(
+        'id', 'operation_type', 'parameters', 'response', 'status',
+        'duration_ms', 'timestamp', 'error_details'
+    )
     
-    operation_data = []
-    for op in operations:
-        operation_data.append({
-            'id': str(op.id),
-            'operation_type': op.operation_type,
-            'parameters': op.parameters,
-            'response': op.response,
-            'status': op.status,
-            'duration_ms': op.duration_ms,
-            'timestamp': op.timestamp.isoformat(),
-            'error_details': op.error_details
-        })
+    try:
+        operation_data, next_cursor = _keyset_page(operations, request)
+    except ValueError as e:
+        return _json({'error': str(e)}, status=400)
     
-    return JsonResponse({
-        'session_id': str(session.id),
-        'operations': operation_data
+    return _json({
+        'session_id': session.id,
+        'operations': operation_data,
+        'next_cursor': next_cursor
+    })
+
+@login_required
+def operation_status(request, operation_id):
+    """Get the status and result of an MCP operation"""
+    operation = get_object_or_404(
+        MCPOperation, id=operation_id, message__session__user=request.user
+    )
+    get_chat_service().expire_stale_operation(operation)
+    
+    return _json({
+        'success': operation.status == 'success',
+        'operation_id': operation.id,
+        'status': operation.status,
+        'response': operation.response,
+        'duration_ms': operation.duration_ms,
+        'error': operation.error_details
     })
 
 @login_required
@@ -219,37 +439,17 @@ def session_operations(request, session_id):
 def update_preferences(request):
     """Update user preferences"""
     try:
-        data = json.loads(request.body)
+        data = _loads(request.body)
         
-        preferences, created = UserPreferences.objects.get_or_create(user=request.user)
+        # Update only the whitelisted preferences that were sent
+        defaults = {key: value for key, value in data.items() if key in _PREFERENCE_FIELDS}
+        UserPreferences.objects.update_or_create(user=request.user, defaults=defaults)
         
-        # Update preferences
-        if 'preferred_ai_provider' in data:
-            preferences.preferred_ai_provider = data['preferred_ai_provider']
-        if 'openai_model' in data:
-            preferences.openai_model = data['openai_model']
-        if 'ollama_model' in data:
-            preferences.ollama_model = data['ollama_model']
-        if 'max_tokens' in data:
-            preferences.max_tokens = data['max_tokens']
-        if 'temperature' in data:
-            preferences.temperature = data['temperature']
-        if 'theme' in data:
-            preferences.theme = data['theme']
-        if 'show_timestamps' in data:
-            preferences.show_timestamps = data['show_timestamps']
-        if 'show_token_usage' in data:
-            preferences.show_token_usage = data['show_token_usage']
-        if 'show_mcp_operations' in data:
-            preferences.show_mcp_operations = data['show_mcp_operations']
-        
-        preferences.save()
-        
-        return JsonResponse({'success': True})
+        return _json({'success': True})
         
     except Exception as e:
         logger.error(f"Error updating preferences: {str(e)}")
-        return JsonResponse({'error': str(e)}, status=500)
+        return _json({'error': str(e)}, status=500)
 
 @login_required
 @require_http_methods(["POST"])
@@ -259,13 +459,13 @@ def delete_session(request, session_id):
     try:
         session = get_object_or_404(ChatSession, id=session_id, user=request.user)
         session.is_active = False
-        session.save()
+        session.save(update_fields=['is_active', 'updated_at'])
         
-        return JsonResponse({'success': True})
+        return _json({'success': True})
         
     except Exception as e:
         logger.error(f"Error deleting session: {str(e)}")
-        return JsonResponse({'error': str(e)}, status=500)
+        return _json({'error': str(e)}, status=500)
 
 def quick_login(request):
     """Quick login for demo purposes"""
@@ -53,6 +53,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = 'chatapp.wsgi.application'
 
+# SQLite stores JSONField columns as TEXT, so every loaded JSON value is
+# decoded in Python; hot querysets defer/skip those columns. On PostgreSQL
+# JSONField maps to jsonb.
 DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
@@ -60,6 +63,18 @@ DATABASES = {
     }
 }
 
+# MCP capabilities and read-only tool results are cached here. LocMemCache is
+# per process: with several workers each keeps its own copy, and a write only
+# invalidates cached tool results in the worker that handled it, so others may
+# serve stale reads for up to TOOL_CACHE_TTL seconds. Multi-worker deployments
+# should point this at a shared backend (Redis, or DatabaseCache after
+# `manage.py createcachetable`).
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',